@@ -0,0 +1,135 @@
+# admissao.py
+# Controle de admissão (load shedding) por classe de rota.
+# Cada classe (uploads, leituras) tem seu próprio limite de concorrência e sua própria fila
+# de espera limitada, para que uma rajada de uploads não derrube a latência das leituras.
+import asyncio
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+
+from starlette.responses import JSONResponse
+
+
+class ServidorSaturado(Exception):
+    def __init__(self, detail: str, retry_after: int):
+        super().__init__(detail)
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class LimitadorConcorrencia:
+    def __init__(self, nome: str, max_concorrentes: int, max_fila: int, timeout_fila: float):
+        self.nome = nome
+        self.max_concorrentes = max_concorrentes
+        self.max_fila = max_fila
+        self.timeout_fila = timeout_fila # Tempo máximo (s) que uma requisição pode esperar na fila
+        self._semaforo = asyncio.Semaphore(max_concorrentes)
+
+        # Métricas
+        self.em_execucao = 0
+        self.na_fila = 0
+        self.admitidas = 0
+        self.enfileiradas = 0
+        self.rejeitadas_fila_cheia = 0
+        self.rejeitadas_timeout = 0
+        self.tempo_total_fila = 0.0
+
+    @property
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self.timeout_fila))
+
+    @asynccontextmanager
+    async def admitir(self):
+        # Conta também quem ainda está aguardando o semáforo, para a decisão não depender de timing
+        enfileirada = self.em_execucao + self.na_fila >= self.max_concorrentes
+        if enfileirada:
+            if self.em_execucao + self.na_fila >= self.max_concorrentes + self.max_fila:
+                self.rejeitadas_fila_cheia += 1
+                raise ServidorSaturado(f"Servidor ocupado ({self.nome}): fila de espera cheia.", self.retry_after)
+            self.enfileiradas += 1
+
+        inicio = time.monotonic()
+        self.na_fila += 1
+        try:
+            await asyncio.wait_for(self._semaforo.acquire(), timeout=self.timeout_fila)
+        except asyncio.TimeoutError:
+            self.rejeitadas_timeout += 1
+            raise ServidorSaturado(f"Servidor ocupado ({self.nome}): tempo de espera na fila esgotado.", self.retry_after)
+        finally:
+            self.na_fila -= 1
+            if enfileirada: # Só quem realmente esperou entra na média de tempo de fila
+                self.tempo_total_fila += time.monotonic() - inicio
+
+        self.admitidas += 1
+        self.em_execucao += 1
+        try:
+            yield
+        finally:
+            self.em_execucao -= 1
+            self._semaforo.release()
+
+    def metricas(self) -> dict:
+        return {
+            "max_concorrentes": self.max_concorrentes,
+            "max_fila": self.max_fila,
+            "timeout_fila": self.timeout_fila,
+            "em_execucao": self.em_execucao,
+            "na_fila": self.na_fila,
+            "admitidas": self.admitidas,
+            "enfileiradas": self.enfileiradas,
+            "rejeitadas_fila_cheia": self.rejeitadas_fila_cheia,
+            "rejeitadas_timeout": self.rejeitadas_timeout,
+            "tempo_medio_fila": self.tempo_total_fila / (self.enfileiradas or 1), # Média entre as requisições enfileiradas
+        }
+
+
+# Limites configuráveis via variáveis de ambiente (mesmo padrão do DATABASE_URL)
+limitador_uploads = LimitadorConcorrencia(
+    "uploads",
+    max_concorrentes=int(os.getenv("UPLOADS_MAX_CONCORRENTES", "4")),
+    max_fila=int(os.getenv("UPLOADS_MAX_FILA", "8")),
+    timeout_fila=float(os.getenv("UPLOADS_TIMEOUT_FILA", "10")),
+)
+limitador_leituras = LimitadorConcorrencia(
+    "leituras",
+    max_concorrentes=int(os.getenv("LEITURAS_MAX_CONCORRENTES", "32")),
+    max_fila=int(os.getenv("LEITURAS_MAX_FILA", "64")),
+    timeout_fila=float(os.getenv("LEITURAS_TIMEOUT_FILA", "2")),
+)
+
+
+def classificar_rota(method: str, path: str) -> LimitadorConcorrencia | None:
+    if method == "POST" and path.rstrip("/") == "/api/v1/objetos":
+        return limitador_uploads
+    if method in ("GET", "HEAD") and path.startswith("/api/v1/"):
+        return limitador_leituras
+    return None # Demais rotas (escritas simples, /health, /static) não são limitadas
+
+
+class ControleAdmissaoMiddleware:
+    # Middleware ASGI puro: a admissão acontece antes de o corpo da requisição ser lido,
+    # então uploads rejeitados não chegam a ocupar memória, arquivos ou sessões do banco.
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        limitador = classificar_rota(scope["method"], scope["path"])
+        if limitador is None:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            async with limitador.admitir():
+                await self.app(scope, receive, send)
+        except ServidorSaturado as e:
+            response = JSONResponse(
+                status_code=503,
+                content={"detail": e.detail},
+                headers={"Retry-After": str(e.retry_after)},
+            )
+            await response(scope, receive, send)
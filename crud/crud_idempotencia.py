@@ -0,0 +1,108 @@
+from sqlalchemy import delete, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+import datetime
+import os
+import uuid
+
+from database import DBMChaveIdempotencia # Seu modelo de tabela SQLAlchemy
+
+STATUS_PROCESSANDO = "processando"
+STATUS_CONCLUIDA = "concluida"
+
+# Por quanto tempo uma resposta concluída pode ser repetida para a mesma chave
+TTL_RESPOSTA = datetime.timedelta(hours=float(os.getenv("IDEMPOTENCIA_TTL_HORAS", "24")))
+# Sem renovação por esse tempo, uma chave ainda "processando" é considerada abandonada (ex: processo reiniciado)
+TTL_PROCESSAMENTO = datetime.timedelta(seconds=float(os.getenv("IDEMPOTENCIA_TIMEOUT_PROCESSAMENTO", "120")))
+
+async def get_chave(db: AsyncSession, chave: str) -> DBMChaveIdempotencia | None:
+    result = await db.execute(
+        select(DBMChaveIdempotencia)
+        .filter(DBMChaveIdempotencia.chave == chave, DBMChaveIdempotencia.expira_em > datetime.datetime.utcnow())
+    )
+    return result.scalars().first()
+
+async def remover_expiradas(db: AsyncSession) -> None:
+    await db.execute(delete(DBMChaveIdempotencia).where(DBMChaveIdempotencia.expira_em <= datetime.datetime.utcnow()))
+    await db.commit()
+
+async def reservar_chave(db: AsyncSession, chave: str, assinatura: str | None) -> str | None:
+    # Retorna o token da reserva, ou None se outra requisição já reservou (ou concluiu) esta chave.
+    # Uma linha expirada desta mesma chave é removida na mesma transação (busca pela chave primária);
+    # a limpeza geral das expiradas roda em segundo plano (idempotencia.limpar_chaves_expiradas).
+    await db.execute(
+        delete(DBMChaveIdempotencia)
+        .where(DBMChaveIdempotencia.chave == chave, DBMChaveIdempotencia.expira_em <= datetime.datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    token = uuid.uuid4().hex
+    db.add(DBMChaveIdempotencia(
+        chave=chave,
+        assinatura=assinatura,
+        token=token,
+        status=STATUS_PROCESSANDO,
+        expira_em=datetime.datetime.utcnow() + TTL_PROCESSAMENTO,
+    ))
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        return None
+    return token
+
+def _filtro_reserva(chave: str, token: str):
+    # Só altera a linha se a reserva ainda for a mesma (não expirou nem foi tomada por um retry)
+    return (
+        DBMChaveIdempotencia.chave == chave,
+        DBMChaveIdempotencia.token == token,
+        DBMChaveIdempotencia.status == STATUS_PROCESSANDO,
+    )
+
+async def registrar_assinatura(db: AsyncSession, chave: str, token: str, assinatura: str) -> bool:
+    # Completa uma reserva feita antes da admissão (sem assinatura, pois o corpo ainda não tinha sido lido)
+    result = await db.execute(
+        update(DBMChaveIdempotencia)
+        .where(*_filtro_reserva(chave, token))
+        .values(assinatura=assinatura)
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+    return result.rowcount == 1
+
+async def renovar_chave(db: AsyncSession, chave: str, token: str) -> bool:
+    result = await db.execute(
+        update(DBMChaveIdempotencia)
+        .where(*_filtro_reserva(chave, token))
+        .values(expira_em=datetime.datetime.utcnow() + TTL_PROCESSAMENTO)
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+    return result.rowcount == 1
+
+async def concluir_chave(db: AsyncSession, chave: str, token: str, status_code: int, resposta: str, commit: bool = True) -> bool:
+    # Com commit=False, a conclusão entra na transação do chamador (ex: junto com a criação do objeto)
+    result = await db.execute(
+        update(DBMChaveIdempotencia)
+        .where(*_filtro_reserva(chave, token))
+        .values(
+            status=STATUS_CONCLUIDA,
+            status_code=status_code,
+            resposta=resposta,
+            expira_em=datetime.datetime.utcnow() + TTL_RESPOSTA,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    if commit:
+        await db.commit()
+    return result.rowcount == 1
+
+async def liberar_chave(db: AsyncSession, chave: str, token: str) -> None:
+    # Remove a reserva quando o processamento falha, para que um retry possa tentar de novo
+    await db.rollback()
+    await db.execute(
+        delete(DBMChaveIdempotencia)
+        .where(*_filtro_reserva(chave, token))
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
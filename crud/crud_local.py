@@ -1,9 +1,11 @@
+from sqlalchemy import delete, insert, literal, true
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
+from sqlalchemy.orm import aliased
 from sqlalchemy.orm import selectinload # Para carregar relacionamentos se necessário no futuro
 
 from models import schemas # Seus schemas Pydantic
-from database import DBMLocal # Seu modelo de tabela SQLAlchemy
+from database import DBMLocal, DBMLocalClosure # Seus modelos de tabela SQLAlchemy
 
 async def get_local(db: AsyncSession, local_id: int) -> DBMLocal | None:
     result = await db.execute(select(DBMLocal).filter(DBMLocal.id == local_id))
@@ -17,19 +19,87 @@ async def get_locais(db: AsyncSession, skip: int = 0, limit: int = 100) -> list[
     result = await db.execute(select(DBMLocal).offset(skip).limit(limit))
     return result.scalars().all()
 
+def subarvore_ids(local_id: int):
+    # Subconsulta com os IDs do local e de todos os seus descendentes (via closure table)
+    return select(DBMLocalClosure.descendente_id).where(DBMLocalClosure.ancestral_id == local_id)
+
+async def _validar_parent(db: AsyncSession, parent_id: int | None, local_id: int | None = None) -> None:
+    if parent_id is None:
+        return
+    if await db.get(DBMLocal, parent_id) is None:
+        raise ValueError(f"Local pai com ID {parent_id} não encontrado.")
+    if local_id is not None:
+        # O novo pai não pode ser o próprio local nem um de seus descendentes (criaria um ciclo)
+        result = await db.execute(
+            select(DBMLocalClosure.descendente_id)
+            .where(DBMLocalClosure.ancestral_id == local_id, DBMLocalClosure.descendente_id == parent_id)
+        )
+        if result.first() is not None:
+            raise ValueError("Um local não pode ser movido para dentro de si mesmo ou de um de seus sublocais.")
+
 async def create_local(db: AsyncSession, local: schemas.LocalCreate) -> DBMLocal:
+    await _validar_parent(db, local.parent_id)
+
     db_local = DBMLocal(**local.model_dump()) # Usar model_dump() para Pydantic v2
     db.add(db_local)
+    await db.flush() # Gera o ID antes de preencher a closure table
+
+    # Caminho para si mesmo + um caminho para cada ancestral do pai
+    await db.execute(insert(DBMLocalClosure).values(ancestral_id=db_local.id, descendente_id=db_local.id, profundidade=0))
+    if db_local.parent_id is not None:
+        await db.execute(
+            insert(DBMLocalClosure).from_select(
+                ["ancestral_id", "descendente_id", "profundidade"],
+                select(DBMLocalClosure.ancestral_id, literal(db_local.id), DBMLocalClosure.profundidade + 1)
+                .where(DBMLocalClosure.descendente_id == db_local.parent_id)
+            )
+        )
+
     await db.commit()
     await db.refresh(db_local)
     return db_local
 
+async def _mover_subarvore(db: AsyncSession, local_id: int, novo_parent_id: int | None) -> None:
+    # Move o local e toda a sua subárvore: apenas as linhas da closure table que ligam
+    # a subárvore aos antigos ancestrais são trocadas. Objetos não são tocados, pois
+    # continuam apontando para o mesmo local.
+    result = await db.execute(subarvore_ids(local_id))
+    ids_subarvore = result.scalars().all()
+    result = await db.execute(
+        select(DBMLocalClosure.ancestral_id)
+        .where(DBMLocalClosure.descendente_id == local_id, DBMLocalClosure.ancestral_id != local_id)
+    )
+    ids_ancestrais = result.scalars().all()
+
+    if ids_ancestrais:
+        await db.execute(
+            delete(DBMLocalClosure)
+            .where(DBMLocalClosure.descendente_id.in_(ids_subarvore), DBMLocalClosure.ancestral_id.in_(ids_ancestrais))
+        )
+
+    if novo_parent_id is not None:
+        acima = aliased(DBMLocalClosure)
+        abaixo = aliased(DBMLocalClosure)
+        await db.execute(
+            insert(DBMLocalClosure).from_select(
+                ["ancestral_id", "descendente_id", "profundidade"],
+                select(acima.ancestral_id, abaixo.descendente_id, acima.profundidade + abaixo.profundidade + 1)
+                .select_from(acima).join(abaixo, true()) # Produto cartesiano: novos ancestrais x subárvore
+                .where(acima.descendente_id == novo_parent_id, abaixo.ancestral_id == local_id)
+            )
+        )
+
 async def update_local(db: AsyncSession, local_id: int, local_update: schemas.LocalUpdate) -> DBMLocal | None:
     db_local = await get_local(db, local_id)
     if db_local is None:
         return None
 
     update_data = local_update.model_dump(exclude_unset=True) # Apenas campos fornecidos
+
+    if 'parent_id' in update_data and update_data['parent_id'] != db_local.parent_id:
+        await _validar_parent(db, update_data['parent_id'], local_id=local_id)
+        await _mover_subarvore(db, local_id, update_data['parent_id'])
+
     for key, value in update_data.items():
         setattr(db_local, key, value)
 
@@ -41,11 +111,17 @@ async def delete_local(db: AsyncSession, local_id: int) -> DBMLocal | None:
     db_local = await get_local(db, local_id)
     if db_local is None:
         return None
-    
+
+    # Não permitir excluir um local que ainda contém sublocais
+    result = await db.execute(select(DBMLocal.id).where(DBMLocal.parent_id == local_id).limit(1))
+    if result.first() is not None:
+        raise ValueError("Não é possível excluir local pois existem sublocais dentro dele. Mova ou exclua os sublocais primeiro.")
+
     # Verificar se há objetos associados a este local antes de excluir (opcional, mas boa prática)
     # if db_local.objetos:
     #     raise ValueError("Não é possível excluir local pois existem objetos associados a ele.")
 
+    await db.execute(delete(DBMLocalClosure).where(DBMLocalClosure.descendente_id == local_id))
     await db.delete(db_local)
     await db.commit()
-    return db_local
\ No newline at end of file
+    return db_local
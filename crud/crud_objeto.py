@@ -5,6 +5,7 @@ from typing import List, Optional
 
 from models import schemas # Seus schemas Pydantic
 from database import DBMObjeto, DBMLocal # Seus modelos de tabela SQLAlchemy
+from crud.crud_local import subarvore_ids
 
 async def get_objeto(db: AsyncSession, objeto_id: int) -> DBMObjeto | None:
     result = await db.execute(
@@ -21,7 +22,8 @@ async def get_objetos(
     nome: Optional[str] = None,
     categoria: Optional[str] = None,
     tag: Optional[str] = None, # Busca por uma tag específica dentro da string de tags
-    localizacao_id: Optional[int] = None
+    localizacao_id: Optional[int] = None,
+    incluir_sublocais: bool = False # Inclui objetos guardados em qualquer sublocal de localizacao_id
 ) -> List[DBMObjeto]:
     
     query = select(DBMObjeto).options(selectinload(DBMObjeto.local_ref))
@@ -36,14 +38,23 @@ async def get_objetos(
         # uma tabela separada de tags ou um DB NoSQL seria melhor.
         query = query.filter(DBMObjeto.tags.ilike(f"%{tag}%"))
     if localizacao_id is not None:
-        query = query.filter(DBMObjeto.localizacao_id == localizacao_id)
+        if incluir_sublocais:
+            # Uma única consulta indexada sobre a closure table, sem percorrer a árvore
+            query = query.filter(DBMObjeto.localizacao_id.in_(subarvore_ids(localizacao_id)))
+        else:
+            query = query.filter(DBMObjeto.localizacao_id == localizacao_id)
         
     query = query.order_by(DBMObjeto.id.desc()).offset(skip).limit(limit) # Ordenar por mais recente
     
     result = await db.execute(query)
     return result.scalars().all()
 
-async def create_objeto(db: AsyncSession, objeto: schemas.ObjetoCreate, caminho_imagem: Optional[str] = None) -> DBMObjeto:
+async def create_objeto(
+    db: AsyncSession,
+    objeto: schemas.ObjetoCreate,
+    caminho_imagem: Optional[str] = None,
+    commit: bool = True # False: apenas flush, para o chamador confirmar junto com outras alterações
+) -> DBMObjeto:
     # Verificar se o local_id fornecido existe, se houver
     if objeto.localizacao_id:
         local_existente = await db.get(DBMLocal, objeto.localizacao_id)
@@ -56,7 +67,10 @@ async def create_objeto(db: AsyncSession, objeto: schemas.ObjetoCreate, caminho_
     
     db_objeto = DBMObjeto(**db_objeto_data)
     db.add(db_objeto)
-    await db.commit()
+    if commit:
+        await db.commit()
+    else:
+        await db.flush()
     await db.refresh(db_objeto)
     
     # Para retornar o objeto com o local carregado após a criação:
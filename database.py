@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, ForeignKey
+from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, ForeignKey, inspect, text, insert, select, literal, exists
 from sqlalchemy.orm import sessionmaker, relationship, declarative_base
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 import datetime
@@ -34,11 +34,22 @@ class DBMLocal(Base): # Renomeei para DBM (Database Model) para evitar conflito
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     nome = Column(String(100), unique=True, nullable=False, index=True)
     descricao = Column(Text, nullable=True)
+    parent_id = Column(Integer, ForeignKey("locais.id"), nullable=True, index=True) # Local "pai" (ex: casa > quarto > armário)
     data_criacao = Column(DateTime, default=datetime.datetime.utcnow)
     data_atualizacao = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
 
     objetos = relationship("DBMObjeto", back_populates="local_ref") # Renomeado para local_ref
 
+class DBMLocalClosure(Base):
+    # Closure table da hierarquia de locais: uma linha para cada par (ancestral, descendente),
+    # incluindo o próprio local com profundidade 0. Permite buscar uma subárvore inteira
+    # com uma única consulta indexada, sem recursão.
+    __tablename__ = "locais_closure"
+
+    ancestral_id = Column(Integer, ForeignKey("locais.id"), primary_key=True)
+    descendente_id = Column(Integer, ForeignKey("locais.id"), primary_key=True, index=True)
+    profundidade = Column(Integer, nullable=False, default=0)
+
 class DBMObjeto(Base):
     __tablename__ = "objetos"
 
@@ -51,15 +62,49 @@ class DBMObjeto(Base):
     data_cadastro = Column(DateTime, default=datetime.datetime.utcnow)
     data_atualizacao = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
 
-    localizacao_id = Column(Integer, ForeignKey("locais.id"), nullable=True)
+    localizacao_id = Column(Integer, ForeignKey("locais.id"), nullable=True, index=True)
     local_ref = relationship("DBMLocal", back_populates="objetos") # Renomeado de "local" para "local_ref"
 
+class DBMChaveIdempotencia(Base):
+    # Resultado de um POST /api/v1/objetos identificado pelo header Idempotency-Key,
+    # para que retries do cliente repitam a resposta em vez de reprocessar o upload.
+    __tablename__ = "chaves_idempotencia"
+
+    chave = Column(String(255), primary_key=True)
+    assinatura = Column(String(64), nullable=True) # Hash dos campos da requisição; None até a rota ler o corpo
+    token = Column(String(32), nullable=False) # Identifica a reserva atual; só o dono pode concluí-la ou liberá-la
+    status = Column(String(20), nullable=False, default="processando") # "processando" ou "concluida"
+    status_code = Column(Integer, nullable=True)
+    resposta = Column(Text, nullable=True) # Corpo da resposta em JSON
+    data_criacao = Column(DateTime, default=datetime.datetime.utcnow)
+    expira_em = Column(DateTime, nullable=False, index=True)
+
 
 # Função para criar as tabelas no banco de dados
+def _migrar_hierarquia_locais(conn):
+    # create_all não altera tabelas existentes: bancos criados antes da hierarquia de locais
+    # precisam da coluna parent_id e dos índices adicionados manualmente.
+    colunas_locais = [coluna["name"] for coluna in inspect(conn).get_columns("locais")]
+    if "parent_id" not in colunas_locais:
+        conn.execute(text("ALTER TABLE locais ADD COLUMN parent_id INTEGER REFERENCES locais(id)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_locais_parent_id ON locais (parent_id)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_objetos_localizacao_id ON objetos (localizacao_id)"))
+
+    # Todo local precisa da linha (id, id, 0) na closure table; locais antigos ainda não a têm
+    conn.execute(
+        insert(DBMLocalClosure).from_select(
+            ["ancestral_id", "descendente_id", "profundidade"],
+            select(DBMLocal.id, DBMLocal.id, literal(0)).where(
+                ~exists().where(DBMLocalClosure.ancestral_id == DBMLocal.id, DBMLocalClosure.descendente_id == DBMLocal.id)
+            )
+        )
+    )
+
 async def create_db_and_tables():
-    async with async_engine.connect() as conn:
+    async with async_engine.begin() as conn:
         # await conn.run_sync(Base.metadata.drop_all) # Cuidado: apaga tudo! Use para resetar.
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_migrar_hierarquia_locais)
     print("Tabelas criadas (se não existiam).")
 
 # Dependência para obter uma sessão do banco de dados em rotas FastAPI
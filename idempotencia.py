@@ -0,0 +1,126 @@
+# idempotencia.py
+# Espera por requisições duplicadas (mesma Idempotency-Key) antes da admissão de uploads.
+# Um retry que chega enquanto a requisição original ainda está em andamento espera aqui,
+# sem ocupar uma vaga do limitador de uploads nem uma sessão do banco durante a espera.
+import asyncio
+import os
+import time
+
+from starlette.responses import JSONResponse
+
+from admissao import limitador_uploads
+from crud import crud_idempotencia
+from database import AsyncSessionLocal
+
+# A espera fica bem abaixo do timeout da fila de uploads, para não acumular retries presos
+IDEMPOTENCIA_TIMEOUT_ESPERA = min(
+    float(os.getenv("IDEMPOTENCIA_TIMEOUT_ESPERA", "5")),
+    limitador_uploads.timeout_fila / 2,
+)
+IDEMPOTENCIA_INTERVALO_CONSULTA = 0.25
+# Mesmo Retry-After em todas as respostas 409 de "ainda em processamento" (middleware e rota)
+RETRY_AFTER_EM_PROCESSAMENTO = str(max(1, round(IDEMPOTENCIA_TIMEOUT_ESPERA)))
+# Intervalo (s) da limpeza periódica das chaves expiradas
+IDEMPOTENCIA_INTERVALO_LIMPEZA = float(os.getenv("IDEMPOTENCIA_INTERVALO_LIMPEZA", "3600"))
+
+
+def obter_chave_idempotencia(scope) -> str | None:
+    if scope["method"] != "POST" or scope["path"].rstrip("/") != "/api/v1/objetos":
+        return None
+    for nome, valor in scope["headers"]:
+        if nome == b"idempotency-key":
+            chave = valor.decode("latin-1")
+            # Chaves vazias ou longas demais são validadas (e rejeitadas) pela própria rota
+            return chave if 0 < len(chave) <= 255 else None
+    return None
+
+
+async def reservar_antes_da_admissao(chave: str) -> str | None:
+    # Sessões curtas por operação: nenhuma conexão fica presa durante a espera
+    async with AsyncSessionLocal() as db:
+        return await crud_idempotencia.reservar_chave(db, chave, assinatura=None)
+
+
+async def status_da_chave(chave: str) -> str | None:
+    async with AsyncSessionLocal() as db:
+        registro = await crud_idempotencia.get_chave(db, chave)
+        return registro.status if registro is not None else None
+
+
+async def liberar_reserva(chave: str, token: str) -> None:
+    # Sem efeito se a rota já concluiu a chave (o filtro exige status "processando" e o mesmo token)
+    try:
+        async with AsyncSessionLocal() as db:
+            await crud_idempotencia.liberar_chave(db, chave, token)
+    except Exception as e:
+        print(f"Erro ao liberar a reserva da Idempotency-Key {chave!r}: {e}")
+
+
+class EsperaIdempotenciaMiddleware:
+    # Deve envolver o ControleAdmissaoMiddleware (ser adicionado depois dele no app).
+    # A chave é reservada antes da admissão: um retry que chega enquanto a requisição original
+    # ainda está na fila de uploads (ou em processamento) espera aqui, sem ocupar uma vaga de
+    # upload nem ler o corpo. A rota completa a reserva com a assinatura e a conclui.
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        chave = obter_chave_idempotencia(scope) if scope["type"] == "http" else None
+        if chave is None:
+            await self.app(scope, receive, send)
+            return
+
+        limite = time.monotonic() + IDEMPOTENCIA_TIMEOUT_ESPERA
+        while (token := await reservar_antes_da_admissao(chave)) is None:
+            status_chave = await status_da_chave(chave)
+            if status_chave == crud_idempotencia.STATUS_CONCLUIDA:
+                break # A rota repete a resposta armazenada (ou rejeita com 422 se os dados diferirem)
+            if status_chave == crud_idempotencia.STATUS_PROCESSANDO:
+                if time.monotonic() >= limite:
+                    response = JSONResponse(
+                        status_code=409,
+                        content={"detail": "Uma requisição com esta Idempotency-Key ainda está em processamento."},
+                        headers={"Retry-After": RETRY_AFTER_EM_PROCESSAMENTO},
+                    )
+                    await response(scope, receive, send)
+                    return
+                await asyncio.sleep(IDEMPOTENCIA_INTERVALO_CONSULTA)
+            # status None: a reserva anterior foi liberada ou expirou, tentar reservar de novo
+
+        if token is None:
+            await self.app(scope, receive, send)
+            return
+
+        scope.setdefault("state", {})["token_idempotencia"] = token # Lido pela rota via request.state
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            # Libera a reserva se a requisição não chegou a concluí-la (ex: 503 na admissão, erro ou desconexão)
+            await liberar_reserva(chave, token)
+
+
+async def manter_reserva(chave: str, token: str) -> None:
+    # Renova periodicamente a expiração da reserva enquanto o upload é processado,
+    # para que um processamento lento não seja confundido com uma reserva abandonada.
+    intervalo = crud_idempotencia.TTL_PROCESSAMENTO.total_seconds() / 3
+    while True:
+        await asyncio.sleep(intervalo)
+        try:
+            async with AsyncSessionLocal() as db:
+                if not await crud_idempotencia.renovar_chave(db, chave, token):
+                    return # A reserva foi concluída, liberada ou tomada: nada mais a renovar
+        except Exception as e:
+            # Ex: "database is locked"; tenta de novo no próximo intervalo, ainda dentro do TTL
+            print(f"Erro ao renovar a reserva da Idempotency-Key {chave!r}: {e}")
+
+
+async def limpar_chaves_expiradas() -> None:
+    # Tarefa de fundo iniciada no startup: remove as chaves expiradas fora do caminho das requisições.
+    # Chaves expiradas já são ignoradas por get_chave, então o atraso da limpeza não afeta o resultado.
+    while True:
+        try:
+            async with AsyncSessionLocal() as db:
+                await crud_idempotencia.remover_expiradas(db)
+        except Exception as e:
+            print(f"Erro ao remover chaves de idempotência expiradas: {e}")
+        await asyncio.sleep(IDEMPOTENCIA_INTERVALO_LIMPEZA)
@@ -1,4 +1,5 @@
 # main.py
+import asyncio
 import os
 from fastapi import FastAPI, Depends # Adicionado Depends
 from dotenv import load_dotenv
@@ -11,6 +12,8 @@ from routers import locais as locais_router, objetos as objetos_router # Importa
 
 # Importar funções e modelos do banco de dados e schemas
 from database import create_db_and_tables, get_db, AsyncSessionLocal # Adicionado AsyncSessionLocal se necessário diretamente
+from admissao import ControleAdmissaoMiddleware, limitador_uploads, limitador_leituras
+from idempotencia import EsperaIdempotenciaMiddleware, limpar_chaves_expiradas
 # Ajustar os imports dos schemas se estiverem em subpastas
 # from models import schemas # Se schemas.py está em models/
 
@@ -27,12 +30,20 @@ app = FastAPI(
     description="API para o aplicativo 'O Curador de Objetos', auxiliando na catalogação e organização de itens pessoais com IA."
 )
 
+# Limites de concorrência por classe de rota (uploads vs leituras), com resposta 503 + Retry-After quando saturado
+app.add_middleware(ControleAdmissaoMiddleware)
+# Adicionado depois para envolver o controle de admissão: retries com Idempotency-Key em andamento
+# esperam aqui, sem ocupar uma vaga de upload
+app.add_middleware(EsperaIdempotenciaMiddleware)
+
 # Evento de inicialização da aplicação
 @app.on_event("startup")
 async def on_startup():
     print("Aplicação iniciando...")
     await create_db_and_tables()
     print("Banco de dados e tabelas verificados/criados.")
+    # Limpeza periódica das Idempotency-Keys expiradas; a referência é guardada para cancelar no shutdown
+    app.state.tarefa_limpeza_idempotencia = asyncio.create_task(limpar_chaves_expiradas())
     # Configurar a API Key do Gemini aqui também pode ser uma opção
     # para garantir que só aconteça uma vez e antes de qualquer rota ser chamada.
     try:
@@ -46,6 +57,18 @@ async def on_startup():
     except Exception as e:
         print(f"Ocorreu um erro inesperado ao configurar a API Key na inicialização: {e}")
 
+# Evento de encerramento da aplicação
+@app.on_event("shutdown")
+async def on_shutdown():
+    tarefa = getattr(app.state, "tarefa_limpeza_idempotencia", None)
+    if tarefa is not None:
+        tarefa.cancel()
+        try:
+            await tarefa
+        except asyncio.CancelledError:
+            pass
+    print("Aplicação encerrada.")
+
 
 @app.get("/")
 async def read_root():
@@ -55,6 +78,13 @@ async def read_root():
 async def health_check():
     return {"status": "API está operacional"}
 
+@app.get("/metrics/admissao")
+async def admission_metrics():
+    return {
+        "uploads": limitador_uploads.metricas(),
+        "leituras": limitador_leituras.metricas(),
+    }
+
 @app.get("/test-gemini")
 async def test_gemini_connection():
     try:
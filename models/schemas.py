@@ -6,6 +6,7 @@ from datetime import datetime
 class LocalBase(BaseModel):
     nome: str = Field(..., min_length=1, max_length=100, examples=["Escritório", "Gaveta da Cômoda"])
     descricao: Optional[str] = Field(None, max_length=255, examples=["Mesa principal do escritório", "Primeira gaveta à esquerda"])
+    parent_id: Optional[int] = Field(None, examples=[1]) # Local "pai"; None para locais de nível raiz
 
 class LocalCreate(LocalBase):
     pass
@@ -13,6 +14,7 @@ class LocalCreate(LocalBase):
 class LocalUpdate(BaseModel): # Permite atualização parcial
     nome: Optional[str] = Field(None, min_length=1, max_length=100)
     descricao: Optional[str] = Field(None, max_length=255)
+    parent_id: Optional[int] = None # Enviar null explicitamente move o local para a raiz
 
 class Local(LocalBase): # Para leitura (resposta da API)
     id: int
@@ -13,7 +13,10 @@ async def create_novo_local(local: schemas.LocalCreate, db: AsyncSession = Depen
     db_local_existente = await crud_local.get_local_by_nome(db, nome=local.nome)
     if db_local_existente:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Local com este nome já existe")
-    return await crud_local.create_local(db=db, local=local)
+    try:
+        return await crud_local.create_local(db=db, local=local)
+    except ValueError as e: # Local pai inexistente
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
 @router.get("/", response_model=List[schemas.Local])
 async def read_locais(skip: int = 0, limit: int = 100, db: AsyncSession = Depends(get_db)):
@@ -35,7 +38,10 @@ async def update_existing_local(local_id: int, local_update: schemas.LocalUpdate
         if db_local_existente_com_nome and db_local_existente_com_nome.id != local_id:
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Outro local com este nome já existe")
 
-    db_local = await crud_local.update_local(db=db, local_id=local_id, local_update=local_update)
+    try:
+        db_local = await crud_local.update_local(db=db, local_id=local_id, local_update=local_update)
+    except ValueError as e: # Local pai inexistente ou movimentação que criaria um ciclo
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
     if db_local is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Local não encontrado para atualizar")
     return db_local
@@ -54,7 +60,10 @@ async def delete_existing_local(local_id: int, db: AsyncSession = Depends(get_db
     #         detail="Não é possível excluir local pois existem objetos associados a ele. Remova ou realoque os objetos primeiro."
     #     )
     
-    deleted_local = await crud_local.delete_local(db=db, local_id=local_id)
+    try:
+        deleted_local = await crud_local.delete_local(db=db, local_id=local_id)
+    except ValueError as e: # Local ainda contém sublocais
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
     # A função crud_local.delete_local já retorna o objeto deletado ou None.
     # Se retornou None é porque não encontrou (já tratado acima).
     # Se chegou aqui, foi deletado.
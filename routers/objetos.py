@@ -6,10 +6,16 @@ from fastapi import (
     status, 
     UploadFile, 
     File, 
-    Form
+    Form,
+    Header,
+    Request
 )
+from fastapi.responses import JSONResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional
+import asyncio
+import hashlib
+import json
 import shutil
 import os
 import uuid
@@ -18,8 +24,9 @@ import google.generativeai as genai # Importar a biblioteca do Gemini
 from PIL import Image # Para manipulação de imagem se necessário (ex: converter formato)
 
 from models import schemas
-from crud import crud_objeto # crud_local não é diretamente usado aqui, mas sim no crud_objeto
+from crud import crud_objeto, crud_local, crud_idempotencia
 from database import get_db
+from idempotencia import manter_reserva, RETRY_AFTER_EM_PROCESSAMENTO
 
 router = APIRouter()
 
@@ -81,16 +88,84 @@ def parse_gemini_response_for_curation(response_text: str) -> tuple[Optional[str
     return sugestao_categoria, sugestao_tags_str
 
 
+async def assinatura_requisicao(nome: str, descricao: Optional[str], localizacao_id: Optional[int], imagem: UploadFile) -> str:
+    # Identifica o conteúdo da requisição, para detectar a mesma Idempotency-Key reutilizada com outros dados.
+    # Inclui o hash dos bytes da imagem: clientes móveis costumam enviar sempre o mesmo nome de arquivo.
+    hash_imagem = hashlib.sha256()
+    while chunk := await imagem.read(1024 * 1024):
+        hash_imagem.update(chunk)
+    await imagem.seek(0) # Reposiciona o cursor para o processamento normal do upload
+
+    dados = json.dumps([nome, descricao, localizacao_id, imagem.content_type, hash_imagem.hexdigest()])
+    return hashlib.sha256(dados.encode("utf-8")).hexdigest()
+
+
 @router.post("/", response_model=schemas.ObjetoComSugestoes, status_code=status.HTTP_201_CREATED) # Alterado response_model
 async def create_novo_objeto(
+    request: Request,
     nome: str = Form(...),
     descricao: Optional[str] = Form(None),
     # categoria e tags agora são primariamente da IA, mas o usuário pode sobrescrever/editar depois
     # Por isso, não os pegamos diretamente do Form aqui para serem preenchidos pela IA
     localizacao_id: Optional[int] = Form(None),
     imagem: UploadFile = File(...), # Tornar imagem obrigatória para sugestão da IA
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=255),
     db: AsyncSession = Depends(get_db)
 ):
+    if not idempotency_key:
+        return await processar_novo_objeto(nome, descricao, localizacao_id, imagem, db)
+
+    # Retries com a mesma Idempotency-Key recebem a resposta já armazenada,
+    # sem salvar outra imagem, chamar o Gemini novamente ou inserir outro objeto.
+    assinatura = await assinatura_requisicao(nome, descricao, localizacao_id, imagem)
+    # A chave normalmente já foi reservada antes da admissão, e a espera por uma requisição
+    # original em andamento acontece lá (ver idempotencia.EsperaIdempotenciaMiddleware);
+    # aqui a rota só completa a reserva com a assinatura e nunca espera com a vaga ocupada.
+    token = getattr(request.state, "token_idempotencia", None)
+    if token is not None and not await crud_idempotencia.registrar_assinatura(db, idempotency_key, token, assinatura):
+        token = None # A reserva antecipada expirou: segue o fluxo normal de reserva abaixo
+    while token is None and (token := await crud_idempotencia.reservar_chave(db, idempotency_key, assinatura)) is None:
+        registro = await crud_idempotencia.get_chave(db, idempotency_key)
+        if registro is None:
+            continue # A requisição original falhou ou expirou: tentar reservar a chave novamente
+        if registro.status == crud_idempotencia.STATUS_CONCLUIDA:
+            if registro.assinatura != assinatura:
+                raise HTTPException(
+                    status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                    detail="Idempotency-Key já utilizada com dados diferentes.",
+                )
+            if imagem.file:
+                imagem.file.close()
+            return JSONResponse(
+                status_code=registro.status_code,
+                content=json.loads(registro.resposta),
+                headers={"Idempotent-Replayed": "true"},
+            )
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Uma requisição com esta Idempotency-Key ainda está em processamento.",
+            headers={"Retry-After": RETRY_AFTER_EM_PROCESSAMENTO},
+        )
+
+    renovacao = asyncio.create_task(manter_reserva(idempotency_key, token))
+    try:
+        # O objeto e a conclusão da chave são confirmados na mesma transação
+        return await processar_novo_objeto(nome, descricao, localizacao_id, imagem, db, reserva=(idempotency_key, token))
+    except Exception:
+        await crud_idempotencia.liberar_chave(db, idempotency_key, token)
+        raise
+    finally:
+        renovacao.cancel()
+
+
+async def processar_novo_objeto(
+    nome: str,
+    descricao: Optional[str],
+    localizacao_id: Optional[int],
+    imagem: UploadFile,
+    db: AsyncSession,
+    reserva: Optional[tuple[str, str]] = None # (Idempotency-Key, token) a concluir junto com o objeto
+) -> schemas.ObjetoComSugestoes:
     if not imagem.content_type.startswith("image/"):
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Arquivo enviado não é uma imagem válida.")
 
@@ -181,11 +256,12 @@ async def create_novo_objeto(
         db_objeto = await crud_objeto.create_objeto(
             db=db, 
             objeto=objeto_data, 
-            caminho_imagem=caminho_relativo_imagem
+            caminho_imagem=caminho_relativo_imagem,
+            commit=reserva is None # Com Idempotency-Key, o commit só acontece junto com a conclusão da chave
         )
 
         # Retornar ObjetoComSugestoes
-        return schemas.ObjetoComSugestoes(
+        resultado = schemas.ObjetoComSugestoes(
             sugestao_categoria=sugestao_categoria_ia,
             sugestao_tags=sugestao_tags_ia_str.split(", ") if sugestao_tags_ia_str else [], # Converte string de tags para lista
             objeto_parcial=schemas.Objeto( # Retorna o objeto completo como foi salvo
@@ -201,6 +277,24 @@ async def create_novo_objeto(
             )
         )
 
+        if reserva is not None:
+            chave, token = reserva
+            if not await crud_idempotencia.concluir_chave(
+                db, chave, token, status.HTTP_201_CREATED, resultado.model_dump_json(), commit=False
+            ):
+                # A reserva expirou e foi tomada por um retry: desfaz o objeto para não duplicá-lo
+                await db.rollback()
+                if caminho_imagem_salva and caminho_imagem_salva.exists():
+                    os.remove(caminho_imagem_salva)
+                raise HTTPException(
+                    status_code=status.HTTP_409_CONFLICT,
+                    detail="A reserva desta Idempotency-Key expirou; outra requisição está processando o objeto.",
+                    headers={"Retry-After": RETRY_AFTER_EM_PROCESSAMENTO},
+                )
+            await db.commit()
+
+        return resultado
+
     except HTTPException: # Re-lançar HTTPExceptions para que o FastAPI as trate
         raise
     except ValueError as e_val: # Captura erro de local_id não encontrado do CRUD
@@ -208,6 +302,7 @@ async def create_novo_objeto(
             os.remove(caminho_imagem_salva)
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e_val))
     except Exception as e_geral:
+        await db.rollback() # Ex: falha no commit final; nada do objeto fica gravado
         if caminho_imagem_salva and caminho_imagem_salva.exists():
             os.remove(caminho_imagem_salva)
         print(f"Erro geral ao criar objeto: {e_geral}")
@@ -225,9 +320,10 @@ async def read_all_objetos(
     categoria: Optional[str] = None,
     tag: Optional[str] = None,
     localizacao_id: Optional[int] = None,
+    incluir_sublocais: bool = False, # Ex: ?localizacao_id=3&incluir_sublocais=true para "tudo neste quarto"
     db: AsyncSession = Depends(get_db)
 ):
-    objetos = await crud_objeto.get_objetos(db, skip, limit, nome, categoria, tag, localizacao_id)
+    objetos = await crud_objeto.get_objetos(db, skip, limit, nome, categoria, tag, localizacao_id, incluir_sublocais)
     return objetos
 
 @router.get("/{objeto_id}", response_model=schemas.Objeto)
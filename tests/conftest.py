@@ -0,0 +1,32 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import httpx
+import pytest_asyncio
+
+# Banco e diretório de trabalho temporários: main.py cria static/ relativo ao diretório atual
+DIRETORIO_TESTES = tempfile.mkdtemp(prefix="curador_testes_")
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{DIRETORIO_TESTES}/test.db"
+os.chdir(DIRETORIO_TESTES)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from database import Base, async_engine, AsyncSessionLocal, create_db_and_tables
+
+
+@pytest_asyncio.fixture
+async def db():
+    async with async_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+    await create_db_and_tables()
+    async with AsyncSessionLocal() as session:
+        yield session
+    await async_engine.dispose() # As conexões do pool pertencem ao event loop deste teste
+
+
+@pytest_asyncio.fixture
+async def client(db):
+    import main
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://teste") as ac:
+        yield ac
@@ -0,0 +1,101 @@
+import asyncio
+
+import httpx
+import pytest
+
+import admissao
+from admissao import ControleAdmissaoMiddleware, LimitadorConcorrencia
+
+pytestmark = pytest.mark.asyncio
+
+
+def app_lento(liberar: asyncio.Event):
+    async def app(scope, receive, send):
+        await liberar.wait()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+    return app
+
+
+@pytest.fixture
+def limitadores(monkeypatch):
+    # Limitadores novos a cada teste: o semáforo pertence ao event loop em que é usado
+    uploads = LimitadorConcorrencia("uploads", max_concorrentes=1, max_fila=1, timeout_fila=0.2)
+    leituras = LimitadorConcorrencia("leituras", max_concorrentes=4, max_fila=4, timeout_fila=1)
+    monkeypatch.setattr(admissao, "limitador_uploads", uploads)
+    monkeypatch.setattr(admissao, "limitador_leituras", leituras)
+    return uploads, leituras
+
+
+def cliente(app):
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=ControleAdmissaoMiddleware(app)), base_url="http://teste")
+
+
+async def test_fila_cheia_retorna_503(limitadores):
+    uploads, _ = limitadores
+    liberar = asyncio.Event()
+    async with cliente(app_lento(liberar)) as c:
+        em_execucao = asyncio.create_task(c.post("/api/v1/objetos/"))
+        na_fila = asyncio.create_task(c.post("/api/v1/objetos/"))
+        await asyncio.sleep(0.05)
+
+        response = await c.post("/api/v1/objetos/")
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "1"
+        assert uploads.rejeitadas_fila_cheia == 1
+
+        liberar.set()
+        assert (await em_execucao).status_code == 200
+        assert (await na_fila).status_code == 200
+
+
+async def test_timeout_na_fila_retorna_503(limitadores):
+    uploads, _ = limitadores
+    liberar = asyncio.Event()
+    async with cliente(app_lento(liberar)) as c:
+        em_execucao = asyncio.create_task(c.post("/api/v1/objetos/"))
+        await asyncio.sleep(0.05)
+
+        response = await c.post("/api/v1/objetos/")
+        assert response.status_code == 503
+        assert "Retry-After" in response.headers
+        assert uploads.rejeitadas_timeout == 1
+
+        liberar.set()
+        assert (await em_execucao).status_code == 200
+
+    metricas = uploads.metricas()
+    assert metricas["em_execucao"] == 0
+    assert metricas["enfileiradas"] == 1
+    # A média considera só a requisição que esperou (~timeout_fila), não a admitida de imediato
+    assert metricas["tempo_medio_fila"] >= uploads.timeout_fila * 0.9
+
+
+async def test_leituras_admitidas_com_uploads_saturados(limitadores):
+    uploads, leituras = limitadores
+    liberar_uploads = asyncio.Event()
+
+    async def app(scope, receive, send):
+        if scope["method"] == "POST":
+            await liberar_uploads.wait()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+
+    async with cliente(app) as c:
+        pendentes = [asyncio.create_task(c.post("/api/v1/objetos/")) for _ in range(2)]
+        await asyncio.sleep(0.05)
+        assert (await c.post("/api/v1/objetos/")).status_code == 503
+
+        response = await c.get("/api/v1/locais/")
+        assert response.status_code == 200
+        assert leituras.admitidas == 1
+
+        liberar_uploads.set()
+        await asyncio.gather(*pendentes)
+
+
+async def test_rotas_nao_classificadas_nao_sao_limitadas(limitadores):
+    assert admissao.classificar_rota("GET", "/health") is None
+    assert admissao.classificar_rota("PUT", "/api/v1/locais/1") is None
+    assert admissao.classificar_rota("POST", "/api/v1/objetos/") is limitadores[0]
+    assert admissao.classificar_rota("GET", "/api/v1/objetos/") is limitadores[1]
@@ -0,0 +1,217 @@
+import asyncio
+import datetime
+import types
+
+import pytest
+from sqlalchemy import update
+
+import admissao
+from admissao import LimitadorConcorrencia
+from crud import crud_idempotencia
+from database import DBMChaveIdempotencia
+from routers import objetos as objetos_router
+
+pytestmark = pytest.mark.asyncio
+
+
+class GeminiFalso:
+    chamadas = 0
+    liberar: asyncio.Event | None = None
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    async def generate_content_async(self, prompt_parts):
+        GeminiFalso.chamadas += 1
+        if GeminiFalso.liberar is not None:
+            await GeminiFalso.liberar.wait()
+        parte = types.SimpleNamespace(text='{"categoria": "caneca", "tags": ["cozinha", "presente"]}')
+        return types.SimpleNamespace(parts=[parte])
+
+
+@pytest.fixture(autouse=True)
+def gemini_falso(monkeypatch):
+    GeminiFalso.chamadas = 0
+    GeminiFalso.liberar = None
+    monkeypatch.setattr(objetos_router.genai, "GenerativeModel", GeminiFalso)
+
+
+@pytest.fixture(autouse=True)
+def limitadores_novos(monkeypatch):
+    # Limitadores novos a cada teste: o semáforo pertence ao event loop em que é usado
+    monkeypatch.setattr(admissao, "limitador_uploads", LimitadorConcorrencia("uploads", 4, 8, 10))
+    monkeypatch.setattr(admissao, "limitador_leituras", LimitadorConcorrencia("leituras", 32, 64, 2))
+
+
+def enviar(client, chave=None, imagem=b"imagem-1", **campos):
+    headers = {"Idempotency-Key": chave} if chave else {}
+    data = {"nome": "Caneca", **{k: str(v) for k, v in campos.items()}}
+    return client.post(
+        "/api/v1/objetos/",
+        headers=headers,
+        data=data,
+        files={"imagem": ("image.jpg", imagem, "image/jpeg")},
+    )
+
+
+async def test_replay_da_resposta_concluida(client):
+    primeira = await enviar(client, "chave-1")
+    segunda = await enviar(client, "chave-1")
+
+    assert primeira.status_code == segunda.status_code == 201
+    assert segunda.headers["Idempotent-Replayed"] == "true"
+    assert segunda.json() == primeira.json()
+    assert GeminiFalso.chamadas == 1
+    assert len((await client.get("/api/v1/objetos/")).json()) == 1
+
+
+async def test_chave_reutilizada_com_outra_imagem(client):
+    assert (await enviar(client, "chave-1", imagem=b"imagem-1")).status_code == 201
+
+    response = await enviar(client, "chave-1", imagem=b"imagem-2")
+    assert response.status_code == 422
+    assert GeminiFalso.chamadas == 1
+
+
+async def test_requisicao_em_andamento_espera_fora_do_limitador(client):
+    GeminiFalso.liberar = asyncio.Event()
+
+    original = asyncio.create_task(enviar(client, "chave-1"))
+    await asyncio.sleep(0.2)
+    retry = asyncio.create_task(enviar(client, "chave-1"))
+    await asyncio.sleep(0.3)
+
+    # O retry espera no middleware de idempotência, sem ocupar uma vaga de upload
+    assert admissao.limitador_uploads.em_execucao == 1
+    assert not retry.done()
+
+    GeminiFalso.liberar.set()
+    resposta_original, resposta_retry = await original, await retry
+    assert resposta_original.status_code == resposta_retry.status_code == 201
+    assert resposta_retry.headers["Idempotent-Replayed"] == "true"
+    assert resposta_retry.json()["objeto_parcial"]["id"] == resposta_original.json()["objeto_parcial"]["id"]
+    assert GeminiFalso.chamadas == 1
+
+
+async def test_retry_com_original_ainda_na_fila_de_uploads(client, monkeypatch):
+    uploads = LimitadorConcorrencia("uploads", max_concorrentes=1, max_fila=2, timeout_fila=10)
+    monkeypatch.setattr(admissao, "limitador_uploads", uploads)
+    GeminiFalso.liberar = asyncio.Event()
+
+    # Uma requisição de outra chave ocupa a única vaga; a original fica na fila de uploads
+    bloqueio = asyncio.create_task(enviar(client, "outra-chave", imagem=b"imagem-0"))
+    await asyncio.sleep(0.2)
+    original = asyncio.create_task(enviar(client, "chave-1"))
+    await asyncio.sleep(0.2)
+    assert uploads.na_fila == 1
+
+    # O retry espera no middleware: não entra na fila nem ocupa vaga de upload
+    retry = asyncio.create_task(enviar(client, "chave-1"))
+    await asyncio.sleep(0.3)
+    assert uploads.na_fila == 1
+    assert uploads.em_execucao == 1
+    assert not retry.done()
+
+    GeminiFalso.liberar.set()
+    resposta_original, resposta_retry = await original, await retry
+    await bloqueio
+    assert resposta_original.status_code == resposta_retry.status_code == 201
+    assert resposta_retry.headers["Idempotent-Replayed"] == "true"
+    assert resposta_retry.json()["objeto_parcial"]["id"] == resposta_original.json()["objeto_parcial"]["id"]
+    assert GeminiFalso.chamadas == 2 # Bloqueio + original; o retry não chama o Gemini
+
+
+async def test_reserva_antecipada_liberada_quando_admissao_rejeita(client, db, monkeypatch):
+    monkeypatch.setattr(admissao, "limitador_uploads", LimitadorConcorrencia("uploads", 0, 0, 1))
+
+    response = await enviar(client, "chave-1")
+    assert response.status_code == 503
+    assert await crud_idempotencia.get_chave(db, "chave-1") is None
+
+
+async def test_chave_liberada_apos_falha(client, db):
+    # O local 1 ainda não existe: a criação falha e a reserva deve ser removida
+    response = await enviar(client, "chave-1", localizacao_id=1)
+    assert response.status_code == 400
+    assert await crud_idempotencia.get_chave(db, "chave-1") is None
+
+    assert (await client.post("/api/v1/locais/", json={"nome": "Cozinha"})).json()["id"] == 1
+    response = await enviar(client, "chave-1", localizacao_id=1)
+    assert response.status_code == 201
+    assert "Idempotent-Replayed" not in response.headers
+    assert GeminiFalso.chamadas == 2
+
+
+async def test_reserva_tomada_nao_e_sobrescrita(db):
+    token_antigo = await crud_idempotencia.reservar_chave(db, "chave-1", "assinatura")
+    # Simula a expiração da reserva original e a reserva por um retry
+    await db.execute(
+        update(DBMChaveIdempotencia)
+        .where(DBMChaveIdempotencia.chave == "chave-1")
+        .values(expira_em=datetime.datetime.utcnow() - datetime.timedelta(seconds=1))
+    )
+    await db.commit()
+    token_novo = await crud_idempotencia.reservar_chave(db, "chave-1", "assinatura")
+    assert token_novo is not None and token_novo != token_antigo
+
+    assert not await crud_idempotencia.concluir_chave(db, "chave-1", token_antigo, 201, "{}")
+    await crud_idempotencia.liberar_chave(db, "chave-1", token_antigo)
+    assert await crud_idempotencia.concluir_chave(db, "chave-1", token_novo, 201, "{}")
+
+
+async def test_falha_ao_concluir_chave_nao_grava_objeto(client, db, monkeypatch):
+    concluir_original = crud_idempotencia.concluir_chave
+
+    async def concluir_com_erro(*args, **kwargs):
+        raise RuntimeError("database is locked")
+
+    monkeypatch.setattr(crud_idempotencia, "concluir_chave", concluir_com_erro)
+    response = await enviar(client, "chave-1")
+    assert response.status_code == 500
+    assert (await client.get("/api/v1/objetos/")).json() == []
+    assert await crud_idempotencia.get_chave(db, "chave-1") is None
+
+    monkeypatch.setattr(crud_idempotencia, "concluir_chave", concluir_original)
+    assert (await enviar(client, "chave-1")).status_code == 201
+    assert len((await client.get("/api/v1/objetos/")).json()) == 1
+
+
+async def test_reserva_perdida_desfaz_objeto(client, monkeypatch):
+    async def reserva_perdida(*args, **kwargs):
+        return False
+
+    monkeypatch.setattr(crud_idempotencia, "concluir_chave", reserva_perdida)
+    response = await enviar(client, "chave-1")
+    assert response.status_code == 409
+    assert "Retry-After" in response.headers
+    assert (await client.get("/api/v1/objetos/")).json() == []
+
+
+async def test_tarefa_de_limpeza_cancelada_no_shutdown(db):
+    import main
+
+    await main.on_startup()
+    tarefa = main.app.state.tarefa_limpeza_idempotencia
+    assert not tarefa.done()
+
+    await main.on_shutdown()
+    assert tarefa.cancelled()
+
+
+async def test_renovacao_continua_apos_erro(db, monkeypatch):
+    import idempotencia
+
+    token = await crud_idempotencia.reservar_chave(db, "chave-1", "assinatura")
+    tentativas = []
+
+    async def renovar_com_erro_inicial(db, chave, token):
+        tentativas.append(chave)
+        if len(tentativas) == 1:
+            raise RuntimeError("database is locked")
+        return len(tentativas) < 3
+
+    monkeypatch.setattr(crud_idempotencia, "renovar_chave", renovar_com_erro_inicial)
+    monkeypatch.setattr(crud_idempotencia, "TTL_PROCESSAMENTO", crud_idempotencia.TTL_PROCESSAMENTO / 1000)
+
+    await asyncio.wait_for(idempotencia.manter_reserva("chave-1", token), timeout=5)
+    assert len(tentativas) == 3
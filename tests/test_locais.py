@@ -0,0 +1,137 @@
+import pytest
+from sqlalchemy import select
+
+from crud import crud_local, crud_objeto
+from database import DBMLocalClosure
+from models import schemas
+
+pytestmark = pytest.mark.asyncio
+
+
+async def caminhos(db):
+    result = await db.execute(
+        select(DBMLocalClosure.ancestral_id, DBMLocalClosure.descendente_id, DBMLocalClosure.profundidade)
+    )
+    return set(result.all())
+
+
+async def criar_arvore(db):
+    # casa > quarto > armario > caixa, e casa > sala
+    casa = await crud_local.create_local(db, schemas.LocalCreate(nome="Casa"))
+    quarto = await crud_local.create_local(db, schemas.LocalCreate(nome="Quarto", parent_id=casa.id))
+    armario = await crud_local.create_local(db, schemas.LocalCreate(nome="Armário", parent_id=quarto.id))
+    caixa = await crud_local.create_local(db, schemas.LocalCreate(nome="Caixa", parent_id=armario.id))
+    sala = await crud_local.create_local(db, schemas.LocalCreate(nome="Sala", parent_id=casa.id))
+    return casa, quarto, armario, caixa, sala
+
+
+async def test_create_local_preenche_closure(db):
+    casa, quarto, armario, caixa, sala = await criar_arvore(db)
+
+    assert await caminhos(db) == {
+        (casa.id, casa.id, 0), (quarto.id, quarto.id, 0), (armario.id, armario.id, 0),
+        (caixa.id, caixa.id, 0), (sala.id, sala.id, 0),
+        (casa.id, quarto.id, 1), (casa.id, armario.id, 2), (casa.id, caixa.id, 3), (casa.id, sala.id, 1),
+        (quarto.id, armario.id, 1), (quarto.id, caixa.id, 2),
+        (armario.id, caixa.id, 1),
+    }
+
+
+async def test_create_local_com_parent_inexistente(db):
+    with pytest.raises(ValueError):
+        await crud_local.create_local(db, schemas.LocalCreate(nome="Órfão", parent_id=999))
+
+
+async def test_mover_local_move_subarvore(db):
+    casa, quarto, armario, caixa, sala = await criar_arvore(db)
+
+    await crud_local.update_local(db, armario.id, schemas.LocalUpdate(parent_id=sala.id))
+
+    atuais = await caminhos(db)
+    assert (quarto.id, armario.id, 1) not in atuais
+    assert (quarto.id, caixa.id, 2) not in atuais
+    assert {(sala.id, armario.id, 1), (sala.id, caixa.id, 2), (casa.id, armario.id, 2), (casa.id, caixa.id, 3)} <= atuais
+    assert (armario.id, caixa.id, 1) in atuais
+
+
+async def test_mover_local_para_raiz(db):
+    casa, quarto, armario, caixa, sala = await criar_arvore(db)
+
+    await crud_local.update_local(db, armario.id, schemas.LocalUpdate(parent_id=None))
+
+    ancestrais_caixa = {a for a, d, _ in await caminhos(db) if d == caixa.id}
+    assert ancestrais_caixa == {armario.id, caixa.id}
+
+
+async def test_mover_local_para_dentro_de_si_mesmo(db):
+    casa, quarto, armario, caixa, sala = await criar_arvore(db)
+    antes = await caminhos(db)
+
+    with pytest.raises(ValueError):
+        await crud_local.update_local(db, quarto.id, schemas.LocalUpdate(parent_id=caixa.id))
+    with pytest.raises(ValueError):
+        await crud_local.update_local(db, quarto.id, schemas.LocalUpdate(parent_id=quarto.id))
+
+    await db.rollback()
+    assert await caminhos(db) == antes
+
+
+async def test_delete_local(db):
+    casa, quarto, armario, caixa, sala = await criar_arvore(db)
+
+    with pytest.raises(ValueError):
+        await crud_local.delete_local(db, armario.id)
+
+    await crud_local.delete_local(db, caixa.id)
+    assert not any(caixa.id in (a, d) for a, d, _ in await caminhos(db))
+
+
+async def test_get_objetos_incluir_sublocais(db):
+    casa, quarto, armario, caixa, sala = await criar_arvore(db)
+    await crud_objeto.create_objeto(db, schemas.ObjetoCreate(nome="Livro", localizacao_id=caixa.id))
+    await crud_objeto.create_objeto(db, schemas.ObjetoCreate(nome="Caneca", localizacao_id=sala.id))
+    await crud_objeto.create_objeto(db, schemas.ObjetoCreate(nome="Abajur", localizacao_id=quarto.id))
+
+    nomes = lambda objetos: sorted(o.nome for o in objetos)
+    assert nomes(await crud_objeto.get_objetos(db, localizacao_id=quarto.id)) == ["Abajur"]
+    assert nomes(await crud_objeto.get_objetos(db, localizacao_id=quarto.id, incluir_sublocais=True)) == ["Abajur", "Livro"]
+    assert nomes(await crud_objeto.get_objetos(db, localizacao_id=casa.id, incluir_sublocais=True)) == ["Abajur", "Caneca", "Livro"]
+
+    await crud_local.update_local(db, armario.id, schemas.LocalUpdate(parent_id=sala.id))
+    assert nomes(await crud_objeto.get_objetos(db, localizacao_id=quarto.id, incluir_sublocais=True)) == ["Abajur"]
+    assert nomes(await crud_objeto.get_objetos(db, localizacao_id=sala.id, incluir_sublocais=True)) == ["Caneca", "Livro"]
+
+
+async def test_api_locais_hierarquia(client):
+    casa = (await client.post("/api/v1/locais/", json={"nome": "Casa"})).json()
+    quarto = (await client.post("/api/v1/locais/", json={"nome": "Quarto", "parent_id": casa["id"]})).json()
+    assert quarto["parent_id"] == casa["id"]
+
+    response = await client.put(f"/api/v1/locais/{casa['id']}", json={"parent_id": quarto["id"]})
+    assert response.status_code == 400
+
+    response = await client.delete(f"/api/v1/locais/{casa['id']}")
+    assert response.status_code == 409
+
+
+async def test_migracao_banco_sem_hierarquia(db):
+    from sqlalchemy import text
+    from database import Base, async_engine, create_db_and_tables
+
+    # Recria "locais" como no esquema anterior à hierarquia (sem parent_id) e sem closure table
+    async with async_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.execute(text(
+            "CREATE TABLE locais (id INTEGER PRIMARY KEY, nome VARCHAR(100) NOT NULL UNIQUE, "
+            "descricao TEXT, data_criacao DATETIME, data_atualizacao DATETIME)"
+        ))
+        await conn.execute(text("INSERT INTO locais (id, nome) VALUES (1, 'Casa'), (2, 'Quarto')"))
+
+    await create_db_and_tables()
+
+    await db.rollback()
+    assert await caminhos(db) == {(1, 1, 0), (2, 2, 0)}
+    await crud_local.update_local(db, 2, schemas.LocalUpdate(parent_id=1))
+    assert (1, 2, 1) in await caminhos(db)
+    with pytest.raises(ValueError):
+        await crud_local.update_local(db, 1, schemas.LocalUpdate(parent_id=2))